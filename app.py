@@ -1,28 +1,233 @@
 import pandas as pd
 import yfinance as yf
 import streamlit as st
-import matplotlib.pyplot as plt
 import numpy as np
-from concurrent.futures import ThreadPoolExecutor
+import requests
+import hashlib
+import json
+import os
 import time
 import warnings
 
 # Suppress yfinance warnings
 warnings.filterwarnings("ignore", category=FutureWarning)
+# Symbols whose history is all-NaN for a field reduce to NaN; no need to warn
+warnings.filterwarnings("ignore", category=RuntimeWarning, message="Mean of empty slice")
+
+# Yahoo serves batch downloads in groups of up to ~20 symbols per request,
+# so larger chunks don't reduce the number of HTTP round-trips further.
+BATCH_SIZE = 20
+
+OHLCV_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+# Part of the disk-cache key, so flipping it invalidates stale entries
+AUTO_ADJUST = True
+
+
+class FileCache:
+    """On-disk TTL cache for downloaded price history, one Parquet file per
+    (symbol, start, end). A warm Streamlit rerun reads from local disk
+    instead of re-hitting Yahoo."""
+
+    def __init__(self, root='.cache', ttl=86400):
+        self.root = root
+        self.ttl = ttl
+
+    def _path(self, symbol, start, end):
+        key = hashlib.md5(f"{symbol}|{start}|{end}|{AUTO_ADJUST}".encode()).hexdigest()
+        return os.path.join(self.root, symbol, f"{key}.parquet")
+
+    def get(self, symbol, start, end):
+        path = self._path(symbol, start, end)
+        meta_path = path + '.json'
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            if time.time() - meta['timestamp'] > self.ttl:
+                return None
+            return pd.read_parquet(path)
+        except Exception:
+            return None
+
+    def set(self, symbol, start, end, df):
+        path = self._path(symbol, start, end)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            df.to_parquet(path)
+            with open(path + '.json', 'w') as f:
+                json.dump({'timestamp': time.time()}, f)
+        except Exception:
+            pass  # Cache writes are best-effort
+
+
+_cache = FileCache()
+
+# One shared HTTP session so TCP/TLS connections are reused across batches
+_session = requests.Session()
+
+
+@st.cache_resource
+def load_workbook(path):
+    """Parse every sheet once with the Rust-backed calamine engine; the
+    resulting dict of frames is shared across reruns and sessions."""
+    sheet_names = pd.ExcelFile(path, engine='calamine').sheet_names
+    return {name: pd.read_excel(path, sheet_name=name, engine='calamine')
+            for name in sheet_names}
+
+
+@st.cache_data
+def to_csv_bytes(df):
+    """Encode once per distinct results frame; reruns reuse the cached bytes."""
+    return df.to_csv(index=False).encode('utf-8')
+
+
+def fetch_stock_data(symbols, start_date, end_date, on_progress=None):
+    """Fetch OHLCV history for each symbol, serving fresh entries from the
+    disk cache and batch-downloading only the misses."""
+    frames = {}
+    missing = []
+    for symbol in symbols:
+        cached = _cache.get(symbol, start_date, end_date)
+        if cached is not None:
+            frames[symbol] = cached
+        else:
+            missing.append(symbol)
+
+    if on_progress and not missing:
+        on_progress(len(frames), len(symbols))
+
+    for i in range(0, len(missing), BATCH_SIZE):
+        batch = missing[i:i+BATCH_SIZE]
+
+        try:
+            # Explicitly set auto_adjust to avoid warning
+            data = yf.download(
+                batch,
+                start=start_date,
+                end=end_date,
+                group_by='ticker',
+                threads=True,
+                progress=False,
+                auto_adjust=AUTO_ADJUST,
+                session=_session
+            )
+        except Exception:
+            data = pd.DataFrame()
+
+        for symbol in batch:
+            if isinstance(data.columns, pd.MultiIndex) and symbol in data.columns.get_level_values(0):
+                stock_data = data[symbol].dropna(how='all')
+            elif not isinstance(data.columns, pd.MultiIndex) and not data.empty:
+                # Single-symbol batches come back with flat columns
+                stock_data = data.dropna(how='all')
+            else:
+                stock_data = None
+
+            if stock_data is not None and not stock_data.empty:
+                # float32 is plenty for the score math and halves the bytes
+                # moved through the cache and the metric reductions
+                stock_data = stock_data.astype(
+                    {col: 'float32' for col in OHLCV_COLUMNS if col in stock_data.columns})
+                _cache.set(symbol, start_date, end_date, stock_data)
+
+            frames[symbol] = stock_data
+
+        if on_progress:
+            on_progress(min(len(frames), len(symbols)), len(symbols))
+
+    return frames
+
+
+def rolling_mean_fast(x, w):
+    """Fixed-width rolling mean from cumulative sums: one O(N) pass with no
+    pandas rolling machinery. NaNs are skipped, so each output is the mean
+    of the valid values in its window (NaN only when the whole window is
+    invalid), and the first w-1 positions are NaN."""
+    if x.size < w:
+        return np.full(x.size, np.nan)
+    valid = ~np.isnan(x)
+    c = np.empty(x.size + 1)
+    c[0] = 0
+    np.cumsum(np.where(valid, x, 0.0), out=c[1:])
+    n = np.empty(x.size + 1)
+    n[0] = 0
+    np.cumsum(valid, out=n[1:])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out = (c[w:] - c[:-w]) / (n[w:] - n[:-w])
+    return np.concatenate([np.full(w - 1, np.nan), out])
+
+
+RESULT_COLUMNS = ['Symbol', 'Avg Volume', 'Avg Dollar Volume', 'Avg Spread (%)',
+                  'Liquidity Score', 'Risk Level', 'Latest Price']
+
+
+def _analyze_stocks(frames):
+    """Compute liquidity metrics for all symbols at once.
+
+    Assembles the fetched histories into (days x symbols) frames and runs
+    the metric math as whole-array operations instead of a Python pipeline
+    per ticker."""
+    frames = {symbol: data for symbol, data in frames.items()
+              if data is not None and not data.empty}
+
+    if not frames:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+
+    # Columns become (symbol, field); each xs below is a (days x symbols) frame
+    panel = pd.concat(frames, axis=1)
+    close = panel.xs('Close', axis=1, level=1)
+    vol = panel.xs('Volume', axis=1, level=1)
+    high = panel.xs('High', axis=1, level=1)
+    low = panel.xs('Low', axis=1, level=1)
+
+    # Work on the raw 2D arrays; the derived values are only ever reduced
+    # to per-symbol means, so no intermediate DataFrames are built
+    c = close.to_numpy(dtype=np.float32)
+    v = vol.to_numpy(dtype=np.float32)
+    h = high.to_numpy(dtype=np.float32)
+    l = low.to_numpy(dtype=np.float32)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dollar_vol = c * v
+        spread = (h - l) / c * 100
+
+        # Each reduction yields one value per symbol
+        avg_volume = np.nanmean(v, axis=0)
+        avg_dollar_volume = np.nanmean(dollar_vol, axis=0)
+        avg_spread = np.nanmean(spread, axis=0)
+
+        volume_score = np.log10(np.clip(avg_volume, 1, None)) / 7
+        spread_score = np.where(avg_spread > 0, 1 - avg_spread / 10, 0.0)
+        liquidity_score = (volume_score * 0.6 + spread_score * 0.4) * 100
+
+    # Last non-NaN close per symbol in a single forward-fill pass
+    latest_price = close.ffill().iloc[-1].to_numpy()
+
+    results_df = pd.DataFrame({
+        'Symbol': close.columns,
+        'Avg Volume': avg_volume,
+        'Avg Dollar Volume': avg_dollar_volume,
+        'Avg Spread (%)': avg_spread,
+        'Liquidity Score': liquidity_score,
+        'Latest Price': latest_price,
+    })
+    # Categorical dtype keeps the column compact for display/filtering
+    results_df['Risk Level'] = pd.cut(
+        results_df['Liquidity Score'],
+        bins=[-np.inf, 40, 70, np.inf],
+        labels=['High Risk', 'Medium Risk', 'Low Risk'])
+    return results_df[RESULT_COLUMNS]
 
 def analyze_liquidity_risk():
     st.title("Stock Liquidity Risk Analysis - Bulk Processing")
     
     # Load stock list
     try:
-        excel_file = pd.ExcelFile('stocklist.xlsx')
-        
-        # Get all sheet names
-        sheet_names = excel_file.sheet_names
-        selected_sheet = st.selectbox("Select a sheet", sheet_names)
-        
-        # Read the selected sheet
-        stock_list = excel_file.parse(selected_sheet)
+        sheets = load_workbook('stocklist.xlsx')
+        selected_sheet = st.selectbox("Select a sheet", list(sheets))
+
+        # Copy so edits below don't leak into the shared cached workbook
+        stock_list = sheets[selected_sheet].copy()
         
         # Assuming the sheet has a column named 'Symbol' containing stock tickers
         if 'Symbol' not in stock_list.columns:
@@ -31,7 +236,8 @@ def analyze_liquidity_risk():
             
         # For Indian stocks, add '.NS' suffix if not already present
         if selected_sheet == 'NIFTY50':
-            stock_list['Symbol'] = stock_list['Symbol'].apply(lambda x: x if x.endswith('.NS') else x + '.NS')
+            needs_suffix = ~stock_list['Symbol'].str.endswith('.NS')
+            stock_list.loc[needs_suffix, 'Symbol'] += '.NS'
             
     except FileNotFoundError:
         st.error("Error: stocklist.xlsx file not found. Please make sure stocklist.xlsx exists in the same directory.")
@@ -54,120 +260,43 @@ def analyze_liquidity_risk():
         st.error("Error: End date must be after start date.")
         return
     
-    # Function to fetch and analyze a single stock
-    def analyze_single_stock(symbol):
-        try:
-            # Explicitly set auto_adjust to avoid warning
-            stock_data = yf.download(
-                symbol, 
-                start=start_date, 
-                end=end_date, 
-                progress=False,
-                auto_adjust=True
-            )
-            
-            if stock_data.empty:
-                return None
-            
-            # Calculate liquidity metrics using Close
-            stock_data['Daily_Volume'] = stock_data['Volume']
-            stock_data['Dollar_Volume'] = stock_data['Close'] * stock_data['Volume']
-            stock_data['Bid_Ask_Spread'] = (stock_data['High'] - stock_data['Low']) / stock_data['Close'] * 100
-            
-            # Calculate averages
-            avg_volume = stock_data['Daily_Volume'].mean()
-            avg_dollar_volume = stock_data['Dollar_Volume'].mean()
-            avg_spread = stock_data['Bid_Ask_Spread'].mean()
-            
-            # Calculate liquidity score
-            volume_score = np.log10(avg_volume) / 7 if avg_volume > 0 else 0
-            spread_score = 1 - (avg_spread / 10) if avg_spread > 0 else 0
-            liquidity_score = (volume_score * 0.6 + spread_score * 0.4) * 100
-            
-            latest_price = stock_data['Close'].iloc[-1] if not pd.isna(stock_data['Close'].iloc[-1]) else None
-            
-            return {
-                'Symbol': symbol,
-                'Avg Volume': avg_volume,
-                'Avg Dollar Volume': avg_dollar_volume,
-                'Avg Spread (%)': avg_spread,
-                'Liquidity Score': liquidity_score,
-                'Risk Level': 'High Risk' if liquidity_score < 40 else 
-                             'Medium Risk' if liquidity_score < 70 else 'Low Risk',
-                'Latest Price': latest_price
-            }
-            
-        except Exception as e:
-            return {
-                'Symbol': symbol,
-                'Avg Volume': None,
-                'Avg Dollar Volume': None,
-                'Avg Spread (%)': None,
-                'Liquidity Score': None,
-                'Risk Level': 'Error',
-                'Latest Price': None
-            }
-    
     # Analyze all stocks with progress bar
     if st.button("Analyze All Stocks"):
         progress_bar = st.progress(0)
         status_text = st.empty()
-        results = []
-        
-        # Process stocks in batches to avoid overwhelming the system
-        batch_size = 10
-        total_stocks = len(stock_list['Symbol'])
-        
-        for i in range(0, total_stocks, batch_size):
-            batch = stock_list['Symbol'][i:i+batch_size]
-            
-            # Use ThreadPoolExecutor for parallel processing within the batch
-            with ThreadPoolExecutor(max_workers=5) as executor:
-                futures = [executor.submit(analyze_single_stock, symbol) for symbol in batch]
-                
-                for future in futures:
-                    try:
-                        result = future.result()
-                        if result:
-                            results.append(result)
-                    except Exception as e:
-                        st.warning(f"Error processing stock: {str(e)}")
-            
-            # Update progress
-            progress = min((i + batch_size) / total_stocks, 1.0)
-            progress_bar.progress(progress)
-            status_text.text(f"Processed {min(i + batch_size, total_stocks)}/{total_stocks} stocks...")
-            time.sleep(0.5)  # Small delay between batches
-        
-        if not results:
+
+        symbols = list(stock_list['Symbol'])
+
+        def on_progress(done, total):
+            progress_bar.progress(min(done / total, 1.0))
+            status_text.text(f"Processed {done}/{total} stocks...")
+
+        # Fetch (from disk cache or Yahoo), then run the vectorized analysis
+        frames = fetch_stock_data(symbols, start_date, end_date, on_progress)
+
+        failed = [s for s in symbols if frames.get(s) is None or frames[s].empty]
+        if failed:
+            shown = ', '.join(failed[:10]) + (', ...' if len(failed) > 10 else '')
+            st.warning(f"No data was retrieved for {len(failed)} of {len(symbols)} stocks: {shown}")
+
+        results_df = _analyze_stocks(frames)
+
+        if results_df.empty:
+            st.session_state.pop('results_df', None)
             st.error("No data was retrieved for any stocks. Please check your inputs and try again.")
-            return
-        
-        # Create results dataframe
-        results_df = pd.DataFrame(results)
-        results_df = results_df.sort_values('Liquidity Score', ascending=False)
-        
+        else:
+            # Sort descending by score via argsort/take on the raw array
+            order = np.argsort(-results_df['Liquidity Score'].to_numpy(), kind='stable')
+            # Keep results across reruns so later widget interactions
+            # (downloads, drill-down) don't re-trigger the analysis
+            st.session_state['results_df'] = results_df.take(order)
+
+    if 'results_df' in st.session_state:
+        results_df = st.session_state['results_df']
+
         # Display results
         st.subheader("Liquidity Analysis Results")
         
-        # Create a copy for display purposes
-        display_df = results_df.copy()
-        
-        # Format numeric columns safely
-        def safe_format(x, fmt):
-            try:
-                if pd.isna(x) or x is None:
-                    return "N/A"
-                return fmt.format(x)
-            except:
-                return "N/A"
-        
-        display_df['Avg Volume'] = display_df['Avg Volume'].apply(lambda x: safe_format(x, "{:,.0f}"))
-        display_df['Avg Dollar Volume'] = display_df['Avg Dollar Volume'].apply(lambda x: safe_format(x, "${:,.2f}"))
-        display_df['Avg Spread (%)'] = display_df['Avg Spread (%)'].apply(lambda x: safe_format(x, "{:.2f}%"))
-        display_df['Liquidity Score'] = display_df['Liquidity Score'].apply(lambda x: safe_format(x, "{:.1f}"))
-        display_df['Latest Price'] = display_df['Latest Price'].apply(lambda x: safe_format(x, "{:.2f}"))
-        
         # Color coding for risk levels
         def color_risk(val):
             if val == 'High Risk':
@@ -177,9 +306,16 @@ def analyze_liquidity_risk():
             elif val == 'Low Risk':
                 return 'color: green'
             else:
-                return 'color: gray'  # For errors
-        
-        styled_df = display_df.style.applymap(color_risk, subset=['Risk Level'])
+                return ''  # NaN scores get no styling
+
+        # Formatting happens at render time; the numeric columns keep their dtype
+        styled_df = results_df.style.format({
+            'Avg Volume': '{:,.0f}',
+            'Avg Dollar Volume': '${:,.2f}',
+            'Avg Spread (%)': '{:.2f}%',
+            'Liquidity Score': '{:.1f}',
+            'Latest Price': '{:.2f}',
+        }, na_rep='N/A').map(color_risk, subset=['Risk Level'])
         st.dataframe(styled_df)
         
         # Summary statistics (only for successful analyses)
@@ -188,7 +324,7 @@ def analyze_liquidity_risk():
         st.subheader("Summary Statistics")
         col1, col2, col3 = st.columns(3)
         with col1:
-            st.metric("Total Stocks Analyzed", len(results))
+            st.metric("Total Stocks Analyzed", len(results_df))
         with col2:
             avg_score = valid_results['Liquidity Score'].mean()
             st.metric("Average Liquidity Score", f"{avg_score:.1f}" if not pd.isna(avg_score) else "N/A")
@@ -199,17 +335,14 @@ def analyze_liquidity_risk():
         # Visualization (only for successful analyses)
         if not valid_results.empty:
             st.subheader("Liquidity Score Distribution")
-            fig, ax = plt.subplots(figsize=(10, 6))
-            valid_results['Liquidity Score'].hist(bins=20, ax=ax, color='skyblue')
-            ax.set_xlabel('Liquidity Score')
-            ax.set_ylabel('Number of Stocks')
-            ax.set_title('Distribution of Liquidity Scores')
-            st.pyplot(fig)
+            score_counts = pd.cut(valid_results['Liquidity Score'], bins=20).value_counts().sort_index()
+            score_counts.index = score_counts.index.astype(str)
+            st.bar_chart(score_counts)
         else:
             st.warning("No valid data available for visualization")
         
         # Download results (original data without formatting)
-        csv = results_df.to_csv(index=False).encode('utf-8')
+        csv = to_csv_bytes(results_df)
         st.download_button(
             label="Download Results as CSV",
             data=csv,
@@ -217,5 +350,40 @@ def analyze_liquidity_risk():
             mime='text/csv'
         )
 
+    # Single-stock drill-down with rolling liquidity trends
+    st.subheader("Single Stock Trend")
+    detail_symbol = st.selectbox("Select a stock for a detailed view", stock_list['Symbol'])
+
+    if st.button("Show Liquidity Trend"):
+        stock_data = fetch_stock_data([detail_symbol], start_date, end_date).get(detail_symbol)
+
+        if stock_data is None or stock_data.empty:
+            st.warning(f"No data available for {detail_symbol}.")
+        else:
+            c = stock_data['Close'].to_numpy()
+            v = stock_data['Volume'].to_numpy()
+            h = stock_data['High'].to_numpy()
+            l = stock_data['Low'].to_numpy()
+            with np.errstate(invalid='ignore', divide='ignore'):
+                dollar_vol = c * v
+                spread = (h - l) / c * 100
+
+            window = 14
+            stock_data = stock_data.assign(
+                Daily_Volume=v,
+                Dollar_Volume=dollar_vol,
+                Bid_Ask_Spread=spread,
+                Rolling_Avg_Volume=rolling_mean_fast(v, window),
+                Rolling_Avg_Dollar_Volume=rolling_mean_fast(dollar_vol, window),
+                Rolling_Avg_Spread=rolling_mean_fast(spread, window),
+            )
+
+            st.caption(f"{detail_symbol} - {window}-day Rolling Avg Volume")
+            st.line_chart(stock_data['Rolling_Avg_Volume'])
+            st.caption(f"{window}-day Rolling Avg Dollar Volume (millions)")
+            st.line_chart(stock_data['Rolling_Avg_Dollar_Volume'] / 1e6)
+            st.caption(f"{window}-day Rolling Avg Spread (%)")
+            st.line_chart(stock_data['Rolling_Avg_Spread'])
+
 if __name__ == "__main__":
     analyze_liquidity_risk()